@@ -2,11 +2,13 @@
 #    Imports
 # --------------------------------------------------
 import argparse
+import atexit
 import datetime
 import os
-import random
+import threading
 import time
 import logging
+import numpy as np
 import pandas as pd
 from pylinkjs.PyLinkJS import run_pylinkjs_app
 from pyLinkJS_Drawing.drawingPlugin import pluginDrawing, CircleObject, RectObject, TextObject
@@ -18,10 +20,17 @@ from pyLinkJS_Drawing.layerController import LayerDataSource, LayerRenderer, Lay
 # --------------------------------------------------
 LAYER_APP = None
 
+# fill styles for the example circles, the position of each style is its category code
+CIRCLE_FILL_DTYPE = pd.CategoricalDtype(['rgba(0, 255, 0, 0.2)', 'rgba(255, 0, 255, 0.2)', 'rgba(192, 192, 192, 0.5)', 'rgba(0, 0, 0, 0)'])
+
 
 # --------------------------------------------------
 #    Event Handlers
 # --------------------------------------------------
+def image_loaded(jsc, img_width, img_height, canvas_width, canvas_height):
+    return LAYER_APP.on_image_loaded(jsc, img_width, img_height, canvas_width, canvas_height)
+
+
 def onmouseup(jsc, x, y, button):
 #    return LAYER_APP.on_mouseup(jsc, x, y, button, LAYER_CONTROLLER)
     return LAYER_APP.on_mouseup(jsc, x, y, button)
@@ -33,7 +42,7 @@ def options_changed(jsc, *args):
 
 def ready(jsc, *args):
 #    return LAYER_APP.on_ready(jsc, jsc.tag['background_file'], 'ctx_drawing', 'ctx_display', LAYER_CONTROLLER)
-    return LAYER_APP.on_ready(jsc, jsc.tag['background_file'], 'ctx_drawing', 'ctx_display')
+    return LAYER_APP.on_ready(jsc, jsc.tag['background_file'], 'ctx_drawing', 'ctx_display', image_loaded_func_name='image_loaded')
 
 
 def reconnect(jsc, *args):
@@ -46,44 +55,103 @@ def reconnect(jsc, *args):
 # --------------------------------------------------
 class LDS_Example_Values(LayerDataSource):
 #    FAKE_DATA = pd.DataFrame(columns=['Value', 'Value_ts', 'PrevValue', 'FirstSeen_ts'], index=[f'D-{i}' for i in range(1, 15)]).fillna(0)
+    # indexes this data source produces values for
+    _ID_POOL = np.array([f'D-{i}' for i in range(1, 15)], dtype=object)
+
+    # file the fake persistent data is kept in, the minimum number of seconds between writes, and this process's copy.
+    # Writes are throttled, so the latest data only lives in this process between writes.  This example relies on the
+    # data fetches running in threads, the LayerController default, with use_processes=True every worker process would
+    # keep its own diverging copy
+    _STATE_FILE = 'Values.csv'
+    _STATE_WRITE_INTERVAL = 30
+    _state_df = None
+    _state_stamp = None
+    _state_write_time = 0
+    _state_unwritten = False
 
     def __init__(self, cooldown_period=5):
         """ init """
         super().__init__(name='ExampleValues', cooldown_period=cooldown_period)
 
+        # write the last throttled change before the program exits
+        atexit.register(self._flush_state)
+
+    @classmethod
+    def _flush_state(cls):
+        """ persist the data if it changed since the last write """
+        if cls._state_unwritten:
+            cls._state_df.to_csv(cls._STATE_FILE)
+            cls._state_stamp = cls._state_file_stamp()
+            cls._state_write_time = time.time()
+            cls._state_unwritten = False
+
+    @classmethod
+    def _state_file_stamp(cls):
+        st = os.stat(cls._STATE_FILE)
+        return (st.st_mtime_ns, st.st_size)
+
+    @classmethod
+    def _read_state(cls):
+        """ return a copy of this process's data, only re-reading the file if it was written from outside since """
+        stamp = cls._state_file_stamp()
+        if cls._state_df is None or stamp != cls._state_stamp:
+            cls._state_df = pd.read_csv(cls._STATE_FILE, index_col=0, parse_dates=['Value_ts', 'FirstSeen_ts'],
+                                        dtype={'Value': np.int32, 'PrevValue': np.int32})
+            cls._state_stamp = stamp
+        return cls._state_df.copy()
+
+    @classmethod
+    def _write_state(cls, df):
+        """ remember the data as this process's copy, and persist it if it changed and the last write is old enough """
+        if cls._state_df is None or not df.equals(cls._state_df):
+            cls._state_unwritten = True
+        cls._state_df = df
+        if (time.time() - cls._state_write_time) >= cls._STATE_WRITE_INTERVAL:
+            cls._flush_state()
+
     @classmethod
     def data_fetch(cls):
         """ fake fetch data """
         time.sleep(1)
         # hacky way to make fake persistent data
         try:
-            df = pd.read_csv('Values.csv', index_col=0)
+            df = cls._read_state()
         except:
             print('Error!')
-            df = pd.DataFrame(columns=['Value', 'Value_ts', 'PrevValue', 'FirstSeen_ts'], index=[f'D-{i}' for i in range(1, 15)]).fillna(0)
+            epoch = pd.Timestamp(0)
+            zeros = np.zeros(len(cls._ID_POOL), dtype=np.int32)
+            df = pd.DataFrame({'Value': zeros, 'Value_ts': epoch, 'PrevValue': zeros, 'FirstSeen_ts': epoch}, index=cls._ID_POOL)
 
         # save the previous values
         df.index.name = 'index'
-        df['Value_ts'] = pd.to_datetime(df['Value_ts'])
-        df['FirstSeen_ts'] = pd.to_datetime(df['FirstSeen_ts'])
         df['PrevValue'] = df['Value']
 
-        # update the values
-        for _ in range(0, random.randint(1, 6)):
-            idx = f'D-{random.randint(1, 14)}'
-            df.loc[idx, 'Value'] = random.randint(0, 200)
-            df.loc[idx, 'Value_ts'] = datetime.datetime.now() - datetime.timedelta(minutes=random.randint(1, 10))
+        # update the values in bulk, all stamped relative to a single capture of the current time
+        now = pd.Timestamp.now()
+        rng = np.random.default_rng()
+        k = rng.integers(1, 7)
+        picks = rng.choice(cls._ID_POOL, k)
+        values = rng.integers(0, 201, k, dtype=np.int32)
+        ages = rng.integers(1, 11, k)
+
+        # an index may be picked more than once, coalesce so only its last update is written
+        _, last = np.unique(picks[::-1], return_index=True)
+        last = k - 1 - last
+        df.loc[picks[last], ['Value', 'Value_ts']] = pd.DataFrame({'Value': values[last], 'Value_ts': now - pd.to_timedelta(ages[last], unit='min')}, index=picks[last])
 
         # fix the firstSeen_ts as needed
-        df.loc[df['Value'] != df['PrevValue'], 'FirstSeen_ts'] = datetime.datetime.now()
+        df.loc[df['Value'] != df['PrevValue'], 'FirstSeen_ts'] = now
 
         # save
-        df.to_csv('Values.csv')
+        cls._write_state(df)
 
         return df
 
 
 class LDS_Example_Open(LayerDataSource):
+    # indexes this data source produces open states for
+    _ID_POOL = np.array([f'D-{i}' for i in range(1, 14)], dtype=object)
+
     def __init__(self, cooldown_period=5):
         """ init """
         super().__init__(name='ExampleOpen', cooldown_period=cooldown_period)
@@ -92,109 +160,150 @@ class LDS_Example_Open(LayerDataSource):
     def data_fetch(cls):
         """ fake fetch data """
         time.sleep(10)
-        idx = []
-        open_vals = []
-        for _ in range(0, random.randint(12, 13)):
-            idx.append(f'D-{random.randint(1,13)}')
-            open_vals.append(random.choice([True, False]))
-        df = pd.DataFrame(data={'Open': open_vals, 'index': idx}).drop_duplicates(subset='index', keep='last').set_index('index')
+
+        # sample all of the indexes and open states in one shot
+        rng = np.random.default_rng()
+        n = rng.integers(12, 14)
+        idx = rng.choice(cls._ID_POOL, n)
+        open_vals = rng.random(n) < 0.5
+        # an index may be sampled more than once, the renderers keep its last open state
+        df = pd.DataFrame(data={'Open': open_vals}, index=pd.Index(idx, name='index'))
         return df
 
 
 class LR_Example_Circle(LayerRenderer):
+    TOOLTIP_TEMPLATE = 'Radius: {circle_radius}<br>'
+
     def layer_init(self, parentObj):
-        for idx, r in self._data.iterrows():
-            circle_obj = CircleObject(name=f'CIRCLE_{idx}', x=r['x'], y=r['y'], radius=1, fillStyle='black', lineWidth=0.1, layer_name=self.name)
-            parentObj.add_child(circle_obj)
+        data = self._data
+        for idx, x, y in zip(data.index.to_numpy(), data['x'].to_numpy(), data['y'].to_numpy()):
+            circle_obj = CircleObject(name=f'CIRCLE_{idx}', x=x, y=y, radius=1, fillStyle='black', lineWidth=0.1, layer_name=self.name)
+            self.add_child(parentObj, idx, circle_obj)
 
     def get_options(self):
         return [{'id': 'circle', 'text': 'Example Circle', 'type': 'Boolean', 'default_value': True}]
 
-    def get_tooltip(self, tooltip_idx):
-        return 'Radius: ' + str(self._data.loc[tooltip_idx].circle_radius) + '<br>'
-
-    def render(self, parentObj, options):
-        # make a copy of the data
-        df = self._data.copy()
+    def prepare_data(self, df):
+        # compute the radius and color of the circles once per data change
+        n = len(df)
 
-        df['circle_radius'] = 0
-        df['circle_fillStyle'] = 'rgba(0, 0, 0, 0)'
+        # anything not explicitly open (including missing) is closed
+        closed = (df['Open'] != True).to_numpy() if 'Open' in df.columns else np.zeros(n, dtype=bool)
 
         if 'Value' in df.columns:
-            df['Value'] = df['Value'].fillna(0)
-            # compute the radius and color of the circle
-            df['circle_radius'] = df.apply(lambda x: max(3, x['Value'] / 20.0), axis=1)
-            df['circle_fillStyle'] = 'rgba(0, 255, 0, 0.2)'
-            df.loc[df['Value'] < 20, 'circle_fillStyle'] = 'rgba(255, 0, 255, 0.2)'
-
-        if 'Open' in df.columns:
-            df['Open'] = df['Open'].fillna(False)
-            df.loc[~(df['Open'] == True), 'circle_radius'] = 2
-            df.loc[~(df['Open'] == True), 'circle_fillStyle'] = 'rgba(192, 192, 192, 0.5)'
+            values = df['Value'].fillna(0).to_numpy(dtype=np.float64)
+            circle_radius = np.maximum(3, values / 20.0)
+            low = values < 20
+            default_fill_code = 0
+        else:
+            circle_radius = np.zeros(n)
+            low = np.zeros(n, dtype=bool)
+            default_fill_code = 3
+
+        # closed circles are small and grey, open circles are colored by value
+        df['circle_radius'] = np.where(closed, 2, circle_radius)
+        fill_codes = np.select([closed, low], [2, 1], default_fill_code).astype(np.int8)
+        df['circle_fillStyle'] = pd.Categorical.from_codes(fill_codes, dtype=CIRCLE_FILL_DTYPE)
+        return df
 
+    def render(self, parentObj, options):
+        data = self._data
         visible = options['circle']
+        if self.skip_hidden_render(parentObj, visible):
+            return
 
-        for idx, r in df.iterrows():
-            if (circleObj := parentObj.children.get(f'CIRCLE_{idx}', None)) is not None:
-                circleObj.props['visible'] = visible
-                circleObj.props['radius'] = r['circle_radius']
-                circleObj.props['fillStyle'] = r['circle_fillStyle']
+        # push the properties to the circle objects
+        children = self.get_children(parentObj)
+        for idx, radius, fillStyle in zip(data.index.to_numpy(), data['circle_radius'].to_numpy(), data['circle_fillStyle'].to_numpy()):
+            if (circleObj := children.get(idx, None)) is not None:
+                circleObj.props.update(visible=visible, radius=radius, fillStyle=fillStyle)
 
 
 class LR_Example_Text(LayerRenderer):
+    TOOLTIP_TEMPLATE = '{idx}<br>Value: {Value}<br>TimeStamp: {Value_ts}<br>'
+
+    def __init__(self, *args, **kwargs):
+        """ init """
+        super().__init__(*args, **kwargs)
+
+        # (data, recent mask) last computed by get_render_key, so render highlights the same values the key was built
+        # from.  Clients are refreshed concurrently and each refresh runs get_render_key then render on one thread, so
+        # the snapshot is kept per thread
+        self._recent_snapshot = threading.local()
+
     def layer_init(self, parentObj):
         click_width = 15
         click_height = 12
-        for idx, r in self._data.iterrows():
-            click_obj = RectObject(name=f'CLICK_{idx}', x=r['x'] - click_width / 2, y=r['y']- click_height / 2, width=click_width, height=click_height, strokeStyle='rgba(0, 0, 0, 0)', fillStyle='rgba(0, 0, 0, 0)', clickable=True, layer_name=self.name, idx=idx)
-            text_obj = TextObject(name=f'TEXT_{idx}', x=r['x'], y=r['y'], text_str='?', lineWidth=0.1, fillStyle='black', font='8pt Arial', textAlign='center', textBaseline='middle', layer_name=self.name, idx=idx)
+        data = self._data
+        for idx, x, y in zip(data.index.to_numpy(), data['x'].to_numpy(), data['y'].to_numpy()):
+            click_obj = RectObject(name=f'CLICK_{idx}', x=x - click_width / 2, y=y - click_height / 2, width=click_width, height=click_height, strokeStyle='rgba(0, 0, 0, 0)', fillStyle='rgba(0, 0, 0, 0)', clickable=True, layer_name=self.name, idx=idx)
+            text_obj = TextObject(name=f'TEXT_{idx}', x=x, y=y, text_str='?', lineWidth=0.1, fillStyle='black', font='8pt Arial', textAlign='center', textBaseline='middle', layer_name=self.name, idx=idx)
             parentObj.add_child(click_obj)
-            parentObj.add_child(text_obj)
+            self.add_child(parentObj, idx, text_obj)
 
     def get_options(self):
         return [{'id': 'text', 'text': 'Example Text', 'type': 'Boolean', 'default_value': True},
                 {'id': 'always_red', 'text': 'Always Red', 'type': 'Boolean', 'default_value': False}]
 
-    def get_tooltip(self, tooltip_idx):
-        return tooltip_idx + '<br>Value: ' + str(self._data.loc[tooltip_idx].Value) + '<br>TimeStamp: ' + str(self._data.loc[tooltip_idx].Value_ts) + '<br>'
-
-    def render(self, parentObj, options):
-        # make a copy of the data
-        df = self._data.copy()
-
-        # set render properties
-        df['text_fillStyle'] = 'black'
-        df['text_font'] = '8pt Arial'
-        df['text_str'] = '?'
-
+    @classmethod
+    def _recent_mask(cls, data):
+        # values which changed in the last 5 seconds are highlighted
+        age = np.datetime64(datetime.datetime.now()) - data['FirstSeen_ts'].to_numpy()
+        return age < np.timedelta64(5, 's')
+
+    def get_render_key(self, options):
+        # the highlight expires with time, so the set of highlighted values is part of the key
+        data = self._data
+        if 'Value' in data.columns:
+            recent = self._recent_mask(data)
+            self._recent_snapshot.value = (data, recent)
+            return (self.data_version, recent.tobytes())
+        return self.data_version
+
+    def prepare_data(self, df):
+        # compute the text labels once per data change
+        n = len(df)
         if 'Value' in df.columns:
-            df['Value'] = df['Value'].fillna(0)
-            df['text_str'] = df['Value'].astype('int').astype('str')
-
-            for idx, r in df.iterrows():
-                if (datetime.datetime.now() - r['FirstSeen_ts']).seconds < 5:
-                    df.loc[idx, 'text_fillStyle'] = 'blue'
-                    df.loc[idx, 'text_font'] = '12pt Arial'
-                else:
-                    df.loc[idx, 'text_fillStyle'] = 'black'
-                    df.loc[idx, 'text_font'] = '8pt Arial'
-
-                if options['always_red']:
-                    df.loc[idx, 'text_fillStyle'] = 'red'
+            text_str = df['Value'].fillna(0).to_numpy(dtype=np.int64).astype(str)
+        else:
+            text_str = np.full(n, '?')
 
         if 'Open' in df.columns:
-            df['Open'] = df['Open'].fillna(False)
-            df.loc[~(df['Open'] == True), 'text_str'] = ''
+            # anything not explicitly open (including missing) is closed
+            text_str[(df['Open'] != True).to_numpy()] = ''
 
+        df['text_str'] = text_str
+        return df
 
+    def render(self, parentObj, options):
         visible = options['text']
-
-        for idx, r in df.iterrows():
-            if (textObj := parentObj.children.get(f'TEXT_{idx}', None)) is not None:
-                textObj.props['visible'] = visible
-                textObj.props['text_str'] = r['text_str']
-                textObj.props['fillStyle'] = r['text_fillStyle']
-                textObj.props['font'] = r['text_font']
+        if self.skip_hidden_render(parentObj, visible):
+            return
+
+        # render the data the render key of this refresh was built from
+        snapshot = getattr(self._recent_snapshot, 'value', None)
+        self._recent_snapshot.value = None
+        data, recent = snapshot if snapshot is not None else (self._data, None)
+        n = len(data)
+
+        if 'Value' in data.columns:
+            # highlight values which changed in the last 5 seconds
+            if recent is None:
+                recent = self._recent_mask(data)
+            text_fillStyle = np.where(recent, 'blue', 'black')
+            text_font = np.where(recent, '12pt Arial', '8pt Arial')
+
+            if options['always_red']:
+                text_fillStyle = np.full(n, 'red', dtype=object)
+        else:
+            text_fillStyle = np.full(n, 'black', dtype=object)
+            text_font = np.full(n, '8pt Arial', dtype=object)
+
+        # push the properties to the text objects
+        children = self.get_children(parentObj)
+        for idx, label, fillStyle, font in zip(data.index.to_numpy(), data['text_str'].to_numpy(), text_fillStyle, text_font):
+            if (textObj := children.get(idx, None)) is not None:
+                textObj.props.update(visible=visible, text_str=label, fillStyle=fillStyle, font=font)
 
 
 # --------------------------------------------------
@@ -206,7 +315,7 @@ def main(args):
 
     # data_coords
     data_coord_file = os.path.join(os.path.dirname(__file__), args['data_coordinate_file'])
-    df_data_coords = pd.read_csv(data_coord_file, index_col=0)
+    df_data_coords = pd.read_csv(data_coord_file, index_col=0, dtype={'x': np.float64, 'y': np.float64})
     lds_data_coords = LayerDataSource(name='data_coords', next_fire_time=None, initial_data=df_data_coords)
     # Example Values
     lds_value = LDS_Example_Values(cooldown_period=1)
@@ -3,14 +3,25 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
+import itertools
 import os
 import math
 import time
 import uuid
-from copy import deepcopy
 from functools import partial
 
 
+# --------------------------------------------------
+#    Globals
+# --------------------------------------------------
+# counter for default render object names
+_name_counter = itertools.count()
+
+# javascript injected into every page, read once at import
+with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'pylinkjsDraw.js'), 'r') as _f:
+    _PLUGIN_JAVASCRIPT = _f.read()
+
+
 # --------------------------------------------------
 #    Classes
 # --------------------------------------------------
@@ -43,6 +54,13 @@ class JSDraw(object):
     # union of all the canvas drawing properties
     ALL_DRAWING_PROPS = DRAWING_PROPS | DRAWING_PROPS_STR
 
+    # drawing functions which change the canvas state, i.e. draw_image sets the filter, and must always be wrapped in a
+    # save / restore
+    STATEFUL_DRAWING_FUNCS = {'image'}
+
+    # command templates of the drawing functions, built on first use
+    _DRAWING_FUNC_TEMPLATES = {}
+
     def __init__(self, canvas_context_working_name, canvas_context_target_name):
         """ init
 
@@ -55,6 +73,18 @@ class JSDraw(object):
         self.__dict__['_canvas_context_target_name'] = canvas_context_target_name
         self.__dict__['_commands'] = []
 
+        # commands which never change are built once
+        self.__dict__['_command_clear'] = f'clear({canvas_context_working_name});'
+        self.__dict__['_command_restore'] = f'{canvas_context_working_name}.restore();'
+        self.__dict__['_command_save'] = f'{canvas_context_working_name}.save();'
+
+        # values of the drawing properties set on this instance
+        self.__dict__['_prop_values'] = {}
+
+        # last command which set each canvas property in the current context, and the stack of saved contexts
+        self.__dict__['_context_state'] = {}
+        self.__dict__['_context_state_stack'] = []
+
     def __getattr__(self, key):
         """ handler for undefined attributes.  Delegate to reading a canvas drawing attribute
 
@@ -65,7 +95,7 @@ class JSDraw(object):
                 the value of the attribute
         """
         if key in self.ALL_DRAWING_PROPS:
-            return self.DRAWING_PROPS[key]
+            return self._prop_values.get(key, None)
         if key in self.DRAWING_FUNCS:
             return partial(self._proxy_func_handler, key, self.DRAWING_FUNCS[key])
 
@@ -73,45 +103,14 @@ class JSDraw(object):
 
     def __setattr__(self, key, value):
         """ handler for undefined attributes.  Delegate to writing a canvas drawing attribute
-            TODO: we can optimize this in the future by not setting properties which have the correct value already
+            Writes which would set a canvas property to the value it already has are skipped
 
             Args:
                 key - name of the attribute to write
                 value - new value for the attribute
         """
         if key in self.ALL_DRAWING_PROPS:
-            # save the value
-            if key in self.DRAWING_PROPS:
-                self.DRAWING_PROPS[key] = value
-            else:
-                self.DRAWING_PROPS_STR[key] = value
-
-            # properties that end with Obj are handled differently, they are written as the object name
-            # without double quotes since we are passing the actual variable and not a string
-            if key.endswith('Obj'):
-                if key[:-3] in self.DRAWING_PROPS:
-                    self.DRAWING_PROPS[key[:-3]] = None
-            if (key + 'Obj') in self.DRAWING_PROPS:
-                self.DRAWING_PROPS[key + 'Obj'] = None
-
-            kwargs = {}
-            kwargs['context_name'] = self._canvas_context_working_name
-            kwargs['prop_name'] = key
-            kwargs['value'] = value
-
-            # properties that end with Obj are handled differently, they are written as the object name
-            # without double quotes since we are passing the actual variable and not a string
-            if key.endswith('Obj'):
-                kwargs['prop_name'] = key[:-3]
-                # add the command to the command queue which willb e sent to javascript
-                self._commands.append(['{context_name}.{prop_name} = {value};', kwargs])
-            else:
-                if key in self.DRAWING_PROPS:
-                    # add the command to the command queue which willb e sent to javascript
-                    self._commands.append(['{context_name}.{prop_name} = {value};', kwargs])
-                else:
-                    # add the command to the command queue which willb e sent to javascript
-                    self._commands.append(['{context_name}.{prop_name} = \'{value}\';', kwargs])
+            self.apply_props({key: value})
         else:
             return super().__setattr__(key, value)
 
@@ -132,60 +131,133 @@ class JSDraw(object):
         # inject the canvas name
         kwargs['context_name'] = self._canvas_context_working_name
 
-        # convert to a named parameter list, i.e. "({x}, {y})"
-        params = ['({context_name}']
-        for x in arg_names:
-            if x.endswith('_str'):
-                params.append(f"'{{{x}}}'")
-            else:
-                params.append(f'{{{x}}}')
-        params[-1] = params[-1] + ');'
-        named_param_string = ','.join(params)
+        # the command template only depends on the function, so build it once
+        template = self._DRAWING_FUNC_TEMPLATES.get(func_name, None)
+        if template is None:
+            # convert to a named parameter list, i.e. "({x}, {y})"
+            params = ['({context_name}']
+            for x in arg_names:
+                if x.endswith('_str'):
+                    params.append(f"'{{{x}}}'")
+                else:
+                    params.append(f'{{{x}}}')
+            params[-1] = params[-1] + ');'
+            named_param_string = ','.join(params)
+            template = f'draw_{func_name}{named_param_string}'
+            self._DRAWING_FUNC_TEMPLATES[func_name] = template
+
+        # only save and restore the context if this call changes it
+        overrides = [k for k in kwargs if k in self.DRAWING_PROPS]
+        save_context = bool(overrides) or (func_name in self.STATEFUL_DRAWING_FUNCS)
 
         # save the context
-        self.context_save()
+        if save_context:
+            self.context_save()
 
         # set the override properties for this function call
-        for k in list(kwargs.keys()):
-            if k in self.DRAWING_PROPS:
-                self.__setattr__(k, kwargs[k])
-                del kwargs[k]
+        for k in overrides:
+            self.__setattr__(k, kwargs[k])
+            del kwargs[k]
 
         # issue the actual drawing command
-        self._commands.append([f'draw_{func_name}{named_param_string}', kwargs])
+        self._commands.append(template.format(**kwargs))
 
         # restore the context
-        self.context_restore()
+        if save_context:
+            self.context_restore()
+
+    def apply_props(self, props, keys=None):
+        """ set multiple canvas drawing properties in one pass
+            Writes which would set a canvas property to the value it already has are skipped
+
+            Args:
+                props - dictionary of property name to value
+                keys - optional list of the keys in props to apply, all keys in props are applied if None
+        """
+        all_drawing_props = self.ALL_DRAWING_PROPS
+        drawing_props = self.DRAWING_PROPS
+        prop_values = self._prop_values
+        context_state = self._context_state
+        context_name = self._canvas_context_working_name
+        commands = []
+
+        for key in (props if keys is None else keys):
+            if key not in all_drawing_props:
+                continue
+
+            # save the value
+            value = props[key]
+            prop_values[key] = value
+
+            # properties that end with Obj are handled differently, they are written as the object name
+            # without double quotes since we are passing the actual variable and not a string.  Object
+            # variables may have been reassigned since they were last set, so they are always written
+            if key.endswith('Obj'):
+                prop_name = key[:-3]
+                if prop_name in all_drawing_props:
+                    prop_values[prop_name] = None
+                command = f'{context_name}.{prop_name} = {value};'
+            else:
+                prop_name = key
+                if key + 'Obj' in all_drawing_props:
+                    prop_values[key + 'Obj'] = None
+                if key in drawing_props:
+                    command = f'{context_name}.{prop_name} = {value};'
+                else:
+                    command = f'{context_name}.{prop_name} = \'{value}\';'
+
+                # skip the command if the canvas property already has this value
+                if context_state.get(prop_name, None) == command:
+                    continue
+            context_state[prop_name] = command
+            commands.append(command)
+
+        # add the commands to the command queue which will be sent to javascript
+        self._commands.extend(commands)
 
     def clear(self):
         """ clear the canvas """
-        self._commands.append(['clear({context_name});', {'context_name': self._canvas_context_working_name}])
+        self._commands.append(self._command_clear)
 
     def clear_renderer(self):
         """ clear the renderer history.  A scene is built up of multiple commands rendered in order.  The deleted all of the commands """
         self._commands = []
 
+        # the next frame starts from whatever state the canvas was left in, so nothing is known about it
+        self._context_state.clear()
+        self._context_state_stack.clear()
+
     def context_restore(self):
         """ restore the canvas context """
-        self._commands.append(['{context_name}.restore();', {'context_name': self._canvas_context_working_name}])
+        self._commands.append(self._command_restore)
+        if self._context_state_stack:
+            self.__dict__['_context_state'] = self._context_state_stack.pop()
+        else:
+            self._context_state.clear()
 
     def context_save(self):
         """ save the canvas context """
-        self._commands.append(['{context_name}.save();', {'context_name': self._canvas_context_working_name}])
+        self._commands.append(self._command_save)
+        self._context_state_stack.append(dict(self._context_state))
 
-    def create_image(self, name, image_src):
+    def create_image(self, name, image_src, onload_code=None):
         """ create an image object
 
             Args:
                 name - name of the new image
                 image_src - url to the image
+                onload_code - optional javascript to run once the image has loaded or failed to load.  The handlers
+                              are attached before the source is set so a cached image can not load unnoticed
 
             Returns:
                 None
         """
-        kwargs = {'name': name, 'image_src': image_src}
-        self._commands.append(['{name} = new Image(100, 100);', kwargs])
-        self._commands.append(["{name}.src = '{image_src}';", kwargs])
+        kwargs = {'name': name, 'image_src': image_src, 'onload_code': onload_code}
+        self._commands.append('{name} = new Image(100, 100);'.format(**kwargs))
+        if onload_code is not None:
+            self._commands.append('{name}.onload = function() {{ {onload_code} }};'.format(**kwargs))
+            self._commands.append('{name}.onerror = function() {{ {onload_code} }};'.format(**kwargs))
+        self._commands.append("{name}.src = '{image_src}';".format(**kwargs))
 
     def gradient_radial(self, name, x0, y0, r0, x1, y1, r1, color_stops):
         """ create a radial gradient
@@ -200,9 +272,24 @@ class JSDraw(object):
                 None
         """
         kwargs = {'context_name': self._canvas_context_working_name, 'name': name, 'x0': x0, 'y0': y0, 'r0': r0, 'x1': x1, 'y1': y1, 'r1': r1}
-        self._commands.append(['{name} = {context_name}.createRadialGradient({x0}, {y0}, {r0}, {x1}, {y1}, {r1});', kwargs])
+        self._commands.append('{name} = {context_name}.createRadialGradient({x0}, {y0}, {r0}, {x1}, {y1}, {r1});'.format(**kwargs))
         for cs in color_stops:
-            self._commands.append(['{name}.addColorStop({r}, \'{c}\');', {'name': name, 'r': cs[0], 'c': cs[1]}])
+            self._commands.append('{name}.addColorStop({r}, \'{c}\');'.format(name=name, r=cs[0], c=cs[1]))
+
+    def compile(self):
+        """ build the javascript which renders the frame, the same javascript can be sent to multiple clients
+
+            Returns:
+                javascript string
+        """
+        # build a javascript string to render, the commands were formatted when they were queued
+        js_list = self._commands + [f'flip({self._canvas_context_working_name}.canvas, {self._canvas_context_target_name});']
+        js = '\\n'.join(js_list)
+
+        # commands rarely contain newlines themselves, so only pay for the escaping pass when one does
+        if '\n' in js:
+            js = js.replace('\n', '\\n')
+        return f'render("{js}");'
 
     def render(self, jsc, clear=True):
         """ render the frame
@@ -216,18 +303,7 @@ class JSDraw(object):
             Returns:
                 None
         """
-        # build a javascript string to render
-        js_list = []
-        for c in self._commands:
-            try:
-                js_list.append(c[0].format(**c[1]))
-            except Exception as e:
-                raise(e)
-        js_list.append(f'flip({self._canvas_context_working_name}.canvas, {self._canvas_context_target_name});')
-        js = '\n'.join(js_list)
-        js = js.replace('\n', '\\n')
-        js = f'render("{js}");'
-        jsc.eval_js_code(js, blocking=True)
+        jsc.eval_js_code(self.compile(), blocking=True)
         if clear:
             self.clear_renderer()
 
@@ -265,6 +341,9 @@ class FlightPlan():
         # vectors are pixels / sec
         self.decision_handler = decision_handler
 
+        # last calculated position as (t, renderObj, scale, positions)
+        self._position_cache = None
+
     def _calculate_time_from_zero(self, t):
         """ calculates the working time from zero
 
@@ -278,48 +357,60 @@ class FlightPlan():
             Returns:
                 working time
         """
-        try:
-            # if the flight plan is paused, return the time offset when it was paused
-            if self.props['pause_time'] is not None:
-                return self.props['pause_time'] - self.props['start_time']
-
-            # if the flight plan has no start time or the time is before the start time, return 0
-            if self.props['start_time'] is None or t <= self.props['start_time']:
-                return 0
-
-            # if the flight plan has no duration, return the elapsed flgiht time
-            tdelta = t - self.props['start_time']
-            if self.props['duration'] is None:
-                return tdelta
-
-            # return either the elapsed flight time or the duration, whichever is less
-            return min(tdelta, self.props['duration'])
-        except:
-            print('AAA')
-            raise Exception()
+        props = self.props
+        start_time = props['start_time']
+
+        # if the flight plan is paused, return the time offset when it was paused
+        pause_time = props['pause_time']
+        if pause_time is not None:
+            return pause_time - start_time
+
+        # if the flight plan has no start time or the time is before the start time, return 0
+        if start_time is None or t <= start_time:
+            return 0
+
+        # if the flight plan has no duration, return the elapsed flgiht time
+        tdelta = t - start_time
+        duration = props['duration']
+        if duration is None:
+            return tdelta
+
+        # return either the elapsed flight time or the duration, whichever is less
+        return min(tdelta, duration)
+
+    def _copy_fprops(self):
+        """ returns a copy of the forward properties for use as working properties.  The forward properties only hold
+            scalars and flat lists of numbers, so copying the lists is enough to keep the working properties independent
+        """
+        return {k: (list(v) if isinstance(v, list) else v) for k, v in self.fprops.items()}
 
     def _set_default_prop_list(self, key, val):
         self.fprops[key] = list(self.fprops.get(key, val))
 
     def calculate_position(self, renderObj, t):
+        # the same position is requested repeatedly for one time, e.g. every child asks for its parent's position
+        scale = renderObj.props['scale']
+        cache = self._position_cache
+        if cache is not None and cache[0] == t and cache[1] is renderObj and cache[2] == scale:
+            return cache[3]
+
         # calculate the position without parent offset
         tz = self._calculate_time_from_zero(t)
         positions = self.custom_calculate_position(tz)
 
-        # scale our positions only if we have a parent
-        if renderObj.parent is not None:
-            positions = [x * renderObj.props['scale'] for x in positions]
-
-        # no parent, just return the position
+        # no parent, just return the position.  Positions are always returned as tuples, so a caller can not modify the
+        # cached position or the start position of a static flight plan through them
         if renderObj.parent is None:
-            return positions
-
-        # there is a parent, so add the parent's position
-        ppos = renderObj.parent.flightplan.calculate_position(renderObj.parent, t)
-        retval = []
-        for i in range(0, len(ppos)):
-            retval.append(positions[i] + ppos[i])
+            retval = tuple(positions)
+        else:
+            # there is a parent, so scale our positions and add the parent's position
+            ppos = renderObj.parent.flightplan.calculate_position(renderObj.parent, t)
+            if len(positions) == 2 and len(ppos) >= 2:
+                retval = (positions[0] * scale + ppos[0], positions[1] * scale + ppos[1])
+            else:
+                retval = tuple(x * scale + p for x, p in zip(positions, ppos))
 
+        self._position_cache = (t, renderObj, scale, retval)
         return retval
 
     def custom_calculate_position(self, tz):
@@ -334,6 +425,9 @@ class FlightPlan():
                 elif hasattr(dh_func, 'decide'):
                     dh_func.decide(renderObj, self, t)
 
+            # the decision handlers may have changed the flight
+            self._position_cache = None
+
         return self.calculate_position(renderObj, t)
 
     def is_active(self, t):
@@ -347,29 +441,83 @@ class FlightPlan():
 
     def pause(self):
         self.props['pause_time'] = time.time()
+        self._position_cache = None
 
     def resume(self):
         delta_time = time.time() - self.props['pause_time']
         self.props['start_time'] += delta_time
         self.props['end_time'] += delta_time
         self.props['pause_time'] = None
+        self._position_cache = None
 
     def start_forward_flight(self, start_time=-99999999):
         """ setup the props for a forward flight from start to end """
-        self.props = deepcopy(self.fprops)
+        self.props = self._copy_fprops()
         if start_time == -99999999:
             start_time = time.time()
         self.props['start_time'] = start_time
+        self._position_cache = None
 
     def start_reverse_flight(self, start_time=-99999999):
         """ setup the props for a reverse flight from start to end """
         raise NotImplementedError
 
 
+class RenderProps(dict):
+    """ properties of a render object.  Adding keys grows the dictionary and removing keys is counted, so together with
+        the length the count tells when the set of keys has changed without slowing down setting or updating values
+    """
+    def __init__(self, *args, **kwargs):
+        """ init """
+        super().__init__(*args, **kwargs)
+
+        # incremented whenever keys are removed
+        self.keys_version = 0
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.keys_version += 1
+
+    def clear(self):
+        super().clear()
+        self.keys_version += 1
+
+    def pop(self, key, *args):
+        had_key = key in self
+        retval = super().pop(key, *args)
+        if had_key:
+            self.keys_version += 1
+        return retval
+
+    def popitem(self):
+        retval = super().popitem()
+        self.keys_version += 1
+        return retval
+
+
 class RenderObject():
+    # size of the grid cells children are bucketed into for hit testing
+    HIT_GRID_CELL_SIZE = 64
+
+    # children covering more grid cells than this along either axis are always hit tested directly
+    HIT_GRID_MAX_CELLS = 16
+
+    # False for objects whose point_in_obj never returns a hit
+    HIT_TESTABLE = True
+
+    # glow colors already calculated, keyed by (rgba string, glow attenuation)
+    _GLOW_COLORS = {}
+    GLOW_COLORS_CACHE_SIZE = 256
+
     def __init__(self, flightplan=None, **kwargs):
         # defaults
-        kwargs['name'] = kwargs.get('name', f'{uuid.uuid4()}')
+        if 'name' not in kwargs:
+            # a uuid is only generated when explicitly asked for, a counter is unique within the process
+            if kwargs.pop('unique_name', False):
+                kwargs['name'] = f'{uuid.uuid4()}'
+            else:
+                kwargs['name'] = f'obj_{next(_name_counter)}'
+        kwargs.pop('unique_name', None)
         kwargs['fillStyle'] = kwargs.get('fillStyle', 'white')
         kwargs['glow'] = kwargs.get('glow', False)
         kwargs['glow_attenuation'] = kwargs.get('glow_attenuation', [0.33, 0.33, 0.33, 0.03])
@@ -387,11 +535,18 @@ class RenderObject():
         self.children = {}
         self.parent = None
 
+        # grid index of the children for hit testing, built on demand by point_in_obj
+        self._hit_index = None
+
+        # keys of the props which are drawing properties, rebuilt by prerender when props gains or loses keys
+        self._drawing_prop_keys = None
+        self._drawing_prop_keys_stamp = None
+
         # save the flightplan
-        self.flightplan = flightplan
+        self._flightplan = flightplan
 
         # save the properties
-        self.props = kwargs.copy()
+        self.props = RenderProps(kwargs)
 
         # clean the properties if Obj and non-Obj exist
         for k in list(self.props.keys()):
@@ -403,9 +558,73 @@ class RenderObject():
         """ custom code per render object to determine if hit is in the object """
         return None
 
+    def _build_hit_index(self, t):
+        """ bucket the children into a grid by their bounds so point_in_obj only needs to test the children near a point
+
+            Args:
+                t - time to calculate the bounds at
+
+            Returns:
+                tuple of (dictionary of grid cell to list of (order, child, x1, y1, x2, y2), list of (order, child) which are
+                always tested)
+        """
+        cell_size = self.HIT_GRID_CELL_SIZE
+        grid = {}
+        always = []
+        static = self._is_static()
+        for order, c in enumerate(self.children.values()):
+            if not c.HIT_TESTABLE:
+                continue
+
+            # only childless objects which can not move have bounds that stay valid
+            bounds = None
+            if static and not c.children and c._is_static():
+                try:
+                    bounds = c.get_bounds(t)
+                except TypeError:
+                    bounds = None
+
+            # objects without finite bounds, e.g. placed at a blank coordinate, can not be bucketed
+            if bounds is None or not all(math.isfinite(b) for b in bounds):
+                always.append((order, c))
+                continue
+
+            cx1, cy1 = math.floor(bounds[0] / cell_size), math.floor(bounds[1] / cell_size)
+            cx2, cy2 = math.floor(bounds[2] / cell_size), math.floor(bounds[3] / cell_size)
+            if (cx2 - cx1) >= self.HIT_GRID_MAX_CELLS or (cy2 - cy1) >= self.HIT_GRID_MAX_CELLS:
+                always.append((order, c))
+                continue
+
+            entry = (order, c, bounds[0], bounds[1], bounds[2], bounds[3])
+            for cx in range(cx1, cx2 + 1):
+                for cy in range(cy1, cy2 + 1):
+                    grid.setdefault((cx, cy), []).append(entry)
+
+        return (grid, always)
+
+    def _is_static(self):
+        """ returns True if neither this object nor any of its parents can move """
+        obj = self
+        while obj is not None:
+            fp = obj.flightplan
+            if fp is not None and not (isinstance(fp, StaticFlightPlan) and not fp.decision_handler):
+                return False
+            obj = obj.parent
+        return True
+
     def add_child(self, childobj):
         self.children[childobj.props['name']] = childobj
         childobj.parent = self
+        self._hit_index = None
+
+    @property
+    def flightplan(self):
+        return self._flightplan
+
+    @flightplan.setter
+    def flightplan(self, flightplan):
+        self._flightplan = flightplan
+        self.geometry_changed()
 
     @classmethod
     def color_calculate_glow(cls, rgba_string, glow_attenuation):
@@ -443,10 +662,16 @@ class RenderObject():
     def draw_glow(self, partial_func, **kwargs):
         # render the glow if needed
         if self.props.get('glow', False):
-            # calculate glow color
-            color_glow = self.color_calculate_glow(
-                kwargs.get('strokeStyle', self.props.get('strokeStyle', 'rgba(0,0,0,0)')),
-                kwargs.get('glow_attenuation', self.props['glow_attenuation']))
+            # calculate glow color, the same few colors recur across objects and frames so remember them
+            rgba_string = kwargs.get('strokeStyle', self.props.get('strokeStyle', 'rgba(0,0,0,0)'))
+            glow_attenuation = kwargs.get('glow_attenuation', self.props['glow_attenuation'])
+            key = (rgba_string, tuple(glow_attenuation))
+            color_glow = self._GLOW_COLORS.get(key, None)
+            if color_glow is None:
+                color_glow = self.color_calculate_glow(rgba_string, glow_attenuation)
+                if len(self._GLOW_COLORS) >= self.GLOW_COLORS_CACHE_SIZE:
+                    self._GLOW_COLORS.clear()
+                self._GLOW_COLORS[key] = color_glow
 
             # draw the glow liens
             for i in range(1, kwargs.get('glow_width', self.props.get('glow_width'))):
@@ -455,6 +680,37 @@ class RenderObject():
         # draw the hard border
         partial_func()
 
+    def geometry_changed(self):
+        """ discard the hit testing index which holds the bounds of this object, call after changing a property which moves
+            or resizes this object
+        """
+        self._hit_index = None
+        if self.parent is not None:
+            self.parent._hit_index = None
+
+    def get_bounds(self, t):
+        """ returns the (x1, y1, x2, y2) bounding box used for hit testing, or None if this object can not be bounded """
+        return None
+
+    def is_static_tree(self):
+        """ returns True if neither this object nor any of its descendants can move """
+        if not self._is_static():
+            return False
+        stack = list(self.children.values())
+        while stack:
+            c = stack.pop()
+            fp = c.flightplan
+            if fp is not None and not (isinstance(fp, StaticFlightPlan) and not fp.decision_handler):
+                return False
+            stack.extend(c.children.values())
+        return True
+
+    def invalidate_hit_index(self):
+        """ discard the hit testing index of this object and its children, call after the size of objects has changed """
+        self._hit_index = None
+        for c in self.children.values():
+            c.invalidate_hit_index()
+
     def point_in_obj(self, x, y, t):
         # init
         retval = []
@@ -463,9 +719,18 @@ class RenderObject():
         if self._point_in_obj(x, y, t):
             retval.append(self)
 
-        # search the children
-        for c in list(self.children.values()):
-            retval = retval + c.point_in_obj(x, y, t)
+        # search the children near the point, in the order they were added
+        if self._hit_index is None:
+            self._hit_index = self._build_hit_index(t)
+        grid, always = self._hit_index
+        cell_size = self.HIT_GRID_CELL_SIZE
+        # reject candidates by their cached bounds before running the exact, position calculating, hit test
+        candidates = [(e[0], e[1]) for e in grid.get((math.floor(x / cell_size), math.floor(y / cell_size)), ())
+                      if e[2] <= x <= e[4] and e[3] <= y <= e[5]]
+        if always:
+            candidates = sorted(candidates + always, key=lambda oc: oc[0])
+        for _, c in candidates:
+            retval.extend(c.point_in_obj(x, y, t))
 
         return retval
 
@@ -473,9 +738,14 @@ class RenderObject():
         """ save the context state and then set the default drawing properties for this render object """
         # apply the properties globally
         f.context_save()
-        for k in self.props:
-            if k in JSDraw.ALL_DRAWING_PROPS:
-                setattr(f, k, self.props[k])
+        props = self.props
+        # props replaced by a plain dictionary can not report removed keys, so their drawing keys are found every time
+        keys_version = getattr(props, 'keys_version', None)
+        stamp = (keys_version, len(props)) if keys_version is not None else None
+        if stamp is None or self._drawing_prop_keys_stamp != stamp:
+            self._drawing_prop_keys = [k for k in props if k in JSDraw.ALL_DRAWING_PROPS]
+            self._drawing_prop_keys_stamp = stamp
+        f.apply_props(props, self._drawing_prop_keys)
 
     def postrender(self, f, t):
         """ restore the context state """
@@ -490,7 +760,7 @@ class RenderObject():
         self.prerender(f, t)
 
         # render the children
-        for v in list(self.children.values()):
+        for v in self.children.values():
             v.render(f, t)
 
         # call customrender
@@ -501,6 +771,7 @@ class RenderObject():
 
     def set_scale(self, new_scale):
         self.props['scale'] = new_scale
+        self.geometry_changed()
         for c in self.children.values():
             c.set_scale(new_scale)
 
@@ -584,17 +855,28 @@ class EllipseObject(RenderObject):
         if self.flightplan:
             # calculate new position
             positions = self.flightplan.get_positions(self, t)
-            f.ellipse(positions[0], positions[1], self.props['radiusX'] * self.props['scale'], self.props['radiusY'] * self.props['scale'],
-                      self.props['rotation'], self.props['startAngle'], self.props['endAngle'], self.props['counterclockwise'])
+            props = self.props
+            scale = props['scale']
+            f.ellipse(positions[0], positions[1], props['radiusX'] * scale, props['radiusY'] * scale,
+                      props['rotation'], props['startAngle'], props['endAngle'], props['counterclockwise'])
 
     def _point_in_obj(self, x, y, t):
         if self.flightplan:
             positions = self.flightplan.get_positions(self, t)
-            dx = (x - positions[0]) / (self.props['radiusX'] * self.props['scale'])
-            dy = (y - positions[1]) / (self.props['radiusY'] * self.props['scale'])
+            props = self.props
+            scale = props['scale']
+            dx = (x - positions[0]) / (props['radiusX'] * scale)
+            dy = (y - positions[1]) / (props['radiusY'] * scale)
             if (dx * dx + dy * dy - 1) <= 0:
                 return self
 
+    def get_bounds(self, t):
+        if self.flightplan:
+            positions = self.flightplan.get_positions(self, t)
+            rx = abs(self.props['radiusX'] * self.props['scale'])
+            ry = abs(self.props['radiusY'] * self.props['scale'])
+            return (positions[0] - rx, positions[1] - ry, positions[0] + rx, positions[1] + ry)
+
 
 class CircleObject(EllipseObject):
     """ x, y, radius """
@@ -602,11 +884,23 @@ class CircleObject(EllipseObject):
         kwargs['radius'] = kwargs.get('radius', 100)
         super().__init__(flightplan=flightplan, **kwargs)
 
-    def customrender(self, f, t):
+    def _sync_radius(self):
+        """ the ellipse radii follow the circle radius """
         self.props['radiusX'] = self.props['radius']
         self.props['radiusY'] = self.props['radius']
+
+    def _point_in_obj(self, x, y, t):
+        self._sync_radius()
+        return super()._point_in_obj(x, y, t)
+
+    def customrender(self, f, t):
+        self._sync_radius()
         super().customrender(f, t)
 
+    def get_bounds(self, t):
+        self._sync_radius()
+        return super().get_bounds(t)
+
 
 class RoundRectObject(RenderObject):
     """ x, y, width, height, radii """
@@ -625,16 +919,25 @@ class RoundRectObject(RenderObject):
         if self.flightplan:
             # calculate new position
             positions = self.flightplan.get_positions(self, t)
-            f.roundRect(positions[0], positions[1], self.props['width'] * self.props['scale'], self.props['height'] * self.props['scale'], self.props['radii'])
+            props = self.props
+            scale = props['scale']
+            f.roundRect(positions[0], positions[1], props['width'] * scale, props['height'] * scale, props['radii'])
 
     def _point_in_obj(self, x, y, t):
         if self.flightplan:
             positions = self.flightplan.get_positions(self, t)
             x = x - positions[0]
             y = y - positions[1]
-            if (x >= 0) and (x < self.props['width'] * self.props['scale']) and (y >= 0) and (y < self.props['height'] * self.props['scale']):
+            props = self.props
+            scale = props['scale']
+            if (x >= 0) and (x < props['width'] * scale) and (y >= 0) and (y < props['height'] * scale):
                 return self
 
+    def get_bounds(self, t):
+        if self.flightplan:
+            positions = self.flightplan.get_positions(self, t)
+            return (positions[0], positions[1], positions[0] + self.props['width'] * self.props['scale'], positions[1] + self.props['height'] * self.props['scale'])
+
 
 class ImageObject(RoundRectObject):
     """ x, y, radius """
@@ -650,17 +953,25 @@ class ImageObject(RoundRectObject):
             # calculate new position
             positions = self.flightplan.get_positions(self, t)
 #            f.roundRect(positions[0], positions[1], self.props['width'] * self.props['scale'], self.props['height'] * self.props['scale'], 0, strokeStyle='red', fillStyle='rgba(0,0,0,0)')
-            if self.props['image_name'] is not None:
-                f.image(self.props['image_name'], positions[0], positions[1], self.props['width'], self.props['height'], filter_str=self.props['filter_str'])
+            props = self.props
+            if props['image_name'] is not None:
+                f.image(props['image_name'], positions[0], positions[1], props['width'], props['height'], filter_str=props['filter_str'])
 
     def _point_in_obj(self, x, y, t):
         if self.flightplan:
             positions = self.flightplan.get_positions(self, t)
             x = x - positions[0]
             y = y - positions[1]
-            if (x >= 0) and (x < self.props['width'] * self.props['scale']) and (y >= 0) and (y < self.props['height'] * self.props['scale']):
+            props = self.props
+            scale = props['scale']
+            if (x >= 0) and (x < props['width'] * scale) and (y >= 0) and (y < props['height'] * scale):
                 return self
 
+    def get_bounds(self, t):
+        if self.flightplan:
+            positions = self.flightplan.get_positions(self, t)
+            return (positions[0], positions[1], positions[0] + self.props['width'] * self.props['scale'], positions[1] + self.props['height'] * self.props['scale'])
+
 
 class RectObject(RoundRectObject):
     """ x, y, radius """
@@ -673,6 +984,8 @@ class TextObject(RenderObject):
     """ x, y, text_str
         fillStyle, strokeStyle
     """
+    HIT_TESTABLE = False
+
     def __init__(self, flightplan=None, **kwargs):
         kwargs['text_str'] = kwargs.get('text_str', 'ABCD')
         if flightplan is None:
@@ -696,6 +1009,8 @@ class TextObject(RenderObject):
 #    Flight Plans
 # --------------------------------------------------
 class OrbitFlightPlan(FlightPlan):
+    DEG_TO_RAD = math.pi / 180.0
+
     def __init__(self, decision_handler=[], duration=None, name=None, **kwargs):
         """
             center - (x, y) center of orbit
@@ -714,25 +1029,25 @@ class OrbitFlightPlan(FlightPlan):
         self.start_forward_flight(start_time=None)
 
     def custom_calculate_position(self, tz):
-        # angle
-        angle = (self.props['vector_start'][0] + self.props['vector'][0] * tz) % 360
-        radius = (self.props['vector_start'][1] + self.props['vector'][1] * tz)
-
-        positions = []
-        for i in range(0, len(self.props['vector'])):
-            if i == 0:
-                positions.append(self.props['center'][0] + math.cos(angle / 360.0 * 2 * math.pi) * radius)
-            elif i == 1:
-                positions.append(self.props['center'][1] + math.sin(angle / 360.0 * 2 * math.pi) * radius)
-            else:
-                self.props['vector_start'][i] + self.props['vector'][i] * tz
+        props = self.props
+        vector_start = props['vector_start']
+        vector = props['vector']
+        center = props['center']
+
+        # angle in radians, cos and sin are periodic so no need to wrap at 360
+        angle = (vector_start[0] + vector[0] * tz) * self.DEG_TO_RAD
+        radius = (vector_start[1] + vector[1] * tz)
+
+        positions = [center[0] + math.cos(angle) * radius]
+        if len(vector) > 1:
+            positions.append(center[1] + math.sin(angle) * radius)
 
         return positions
 
     def start_reverse_flight(self, start_time=-99999999):
         """ setup the props for a reverse flight from start to end """
         tz = self._calculate_time_from_zero(time.time())
-        self.props = deepcopy(self.fprops)
+        self.props = self._copy_fprops()
 
         for i in range (0, len(self.props['vector_start'])):
             self.props['vector_start'][i] = self.props['vector_start'][i] + self.props['vector'][i] * tz
@@ -743,6 +1058,7 @@ class OrbitFlightPlan(FlightPlan):
             start_time = time.time()
 
         self.props['start_time'] = start_time
+        self._position_cache = None
 
 
 class StaticFlightPlan(FlightPlan):
@@ -793,13 +1109,12 @@ class pluginDrawing:
         self.jsc_exposed_funcs = {'drawing': lambda jsc : self._drawing}
 
         # cache the javascript for injection
-        f = open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'pylinkjsDraw.js'), 'r')
-        self._plugin_javascript = f.read()
-        f.close()
+        self._plugin_javascript = _PLUGIN_JAVASCRIPT
+        self._plugin_html_top = '<script>' + _PLUGIN_JAVASCRIPT + '</script>'
 
     def inject_html_top(self):
         # return the javascript to inject into every page
-        return '<script>' + self._plugin_javascript + '</script>'
+        return self._plugin_html_top
 
     def register(self, kwargs):
         """ callback to register this plugin with the framework """
@@ -3,10 +3,12 @@
 # --------------------------------------------------
 import concurrent.futures
 import datetime
+import json
 import logging
 import threading
 import time
 import traceback
+import weakref
 import pandas as pd
 from pyLinkJS_Drawing.drawingPlugin import JSDraw, ImageObject, RectObject
 from pylinkjs.PyLinkJS import get_broadcast_jsclients
@@ -16,10 +18,14 @@ from pylinkjs.PyLinkJS import get_broadcast_jsclients
 #    Classes
 # --------------------------------------------------
 class LayerRenderer():
+    # template for the tooltip html, formatted with the data row of the tooltip index plus the index as {idx}
+    TOOLTIP_TEMPLATE = None
+
     def __init__(self, name, starting_data_dict={}, subscribed_datasources=[]):
         """ init for LayerRenderer
 
             Public Attributes:
+                data_version - incremented every time the data for this renderer changes
                 name - unique name of this LayerRenderer
                 subscribed datasources - list of layer datasource names this renderer subscribes to
 
@@ -28,17 +34,23 @@ class LayerRenderer():
                 starting_data_dict - starting data for this renderer in order to perform layer init
                 subscribed datasources - list of layer datasource names this renderer subscribes to
         """
-        self._data = self._data_dict_to_df(starting_data_dict)
+        self._child_refs = weakref.WeakKeyDictionary()
+        self._hidden_parents = weakref.WeakSet()
+        self.data_version = 0
         self.name = name
         self.subscribed_datasources = list(subscribed_datasources)
         self.visible = True
+        self._piece_cache = {}
+        self._data = self.prepare_data(self._data_dict_to_df(starting_data_dict, self._piece_cache))
 
     @classmethod
-    def _data_dict_to_df(cls, data_dict):
+    def _data_dict_to_df(cls, data_dict, piece_cache=None):
         """ convert a dictionary of dataframes into a giant dataframe
 
             Args:
                 data_dict - dictionary of dataframes
+                piece_cache - optional dictionary of aligned dataframes from the previous call, updated in place.
+                              Dataframes which are the same objects as last time are not aligned again
 
             Returns:
                 dataframe which is a union of all the dataframes in the dictionary
@@ -48,41 +60,125 @@ class LayerRenderer():
         if len(keys) == 0:
             return pd.DataFrame()
 
-        # build union of indexes
-        idx = data_dict[keys[0]].index
-        for k in keys[1:]:
-            idx = idx.union(data_dict[k].index)
-        idx = idx.drop_duplicates(keep='last')
+        # only rows in data_coords are kept, so align all the data directly on the data_coords index
+        target_idx = data_dict['data_coords'].index
 
-        # init return dataframe
-        df = pd.DataFrame(index=idx)
+        # forget cached pieces of data sources which are no longer in the dictionary
+        if piece_cache is not None:
+            for k in [k for k in piece_cache if k not in data_dict]:
+                del piece_cache[k]
 
-        # add in all the data
+        # align all the data on the index and join it in one concat, columns from later dataframes win
+        pieces = []
         for k in keys:
-            df_new = data_dict[k][~data_dict[k].index.duplicated(keep='last')]
-            for c in df_new.columns:
-                df[c] = df_new[c]
-
-        # intersection with data_coords
-        df = df.loc[data_dict['data_coords'].index]
+            source = data_dict[k]
+
+            # data sources publish new dataframes when their data changes, so an unchanged source aligned
+            # against an unchanged data_coords index can reuse the last aligned piece
+            cached = piece_cache.get(k, None) if piece_cache is not None else None
+            if cached is not None and cached[0] is source and cached[1] is target_idx:
+                pieces.append(cached[2])
+                continue
+
+            # only build the duplicate mask if there are duplicates, most data sources are already unique
+            piece = source
+            if piece.index.has_duplicates:
+                piece = piece[~piece.index.duplicated(keep='last')]
+            # data sources which already share the data_coords index need no alignment
+            if not (piece.index is target_idx or piece.index.equals(target_idx)):
+                piece = piece.reindex(target_idx)
+            if piece_cache is not None:
+                piece_cache[k] = (source, target_idx, piece)
+            pieces.append(piece)
+        df = pd.concat(pieces, axis=1, sort=False)
+        if df.columns.has_duplicates:
+            df = df.loc[:, ~df.columns.duplicated(keep='last')]
 
         # success!
         return df
 
+    def add_child(self, parentObj, idx, childObj):
+        """ add a render object to the parent and remember it so render can find it without a name lookup
+
+            Args:
+                parentObj - render object to add the child to
+                idx - index of the data row the child object represents
+                childObj - render object to add
+        """
+        parentObj.add_child(childObj)
+        self._child_refs.setdefault(parentObj, {})[idx] = childObj
+
+    def get_children(self, parentObj):
+        """ return the render objects added to the parent by add_child
+
+            Args:
+                parentObj - render object the children were added to
+
+            Returns:
+                dictionary of data row index to render object
+        """
+        return self._child_refs.get(parentObj, {})
+
     def get_options(self):
         return {}
 
-    def get_tooltip(self, wx, wy, rolist):
-        return ''
+    def get_render_key(self, options):
+        """ returns a value which changes whenever render would produce different properties, a client is only
+            rerendered when the render key of a renderer or its options change
+
+            Args:
+                options - dictionary of option values for the client
+
+            Returns:
+                hashable render key, by default the data version
+        """
+        return self.data_version
+
+    def get_tooltip(self, tooltip_idx):
+        """ returns the tooltip html for a data row, by default TOOLTIP_TEMPLATE formatted with the row
+
+            Args:
+                tooltip_idx - index of the data row
+
+            Returns:
+                tooltip html
+        """
+        if self.TOOLTIP_TEMPLATE is None:
+            return ''
+        return self.TOOLTIP_TEMPLATE.format_map({**self._data.loc[tooltip_idx].to_dict(), 'idx': tooltip_idx})
+
+    def skip_hidden_render(self, parentObj, visible):
+        """ returns True if render can skip updating the objects on a parent because the layer is hidden and the objects
+            were already hidden by a previous render
+
+            Args:
+                parentObj - render object the layer renders to
+                visible - True if the layer is visible for this render
+
+            Returns:
+                True if render can be skipped, False if render must update the objects
+        """
+        if visible:
+            self._hidden_parents.discard(parentObj)
+            return False
+        if parentObj in self._hidden_parents:
+            return True
+        self._hidden_parents.add(parentObj)
+        return False
 
     def layer_init(self):
         """ Initialize render objects
 
+            Every client gets its own render objects, but clients whose scene can not move share one compiled frame per
+            render key and canvas layout.  layer_init must therefore create the same objects for every client, only from
+            data which is the same for all of them such as the starting data, and render must only change the props of
+            the objects created here, never add or remove objects
+
             Args:
                 initial_data_coords - dataframe containing x, y coordinates for data objects
                 parentObj - object to create render objects on
         """
-        raise NotImplemented()
+        raise NotImplementedError
 
     def on_data_changed(self, data_dict):
         """ Callback when subscribed data changes
@@ -90,12 +186,25 @@ class LayerRenderer():
             Args:
                 data_dict - dictionary of dataframes from data sources.
         """
-        # merge the data
-        self._data = self._data_dict_to_df(data_dict)
+        # merge the data and publish it in one assignment so render never sees a half built frame
+        self._data = self.prepare_data(self._data_dict_to_df(data_dict, self._piece_cache))
+        self.data_version += 1
+
+    def prepare_data(self, df):
+        """ Hook to add derived columns to freshly merged data.  Runs once per data change instead of once
+            per render, so per row render properties which only depend on the data belong here
+
+            Args:
+                df - merged dataframe of all subscribed data sources, owned by this renderer
+
+            Returns:
+                dataframe which will become the data for this renderer
+        """
+        return df
 
     def render(self, parentObj, options):
         """ update properties on data objects for rendering """
-        raise NotImplemented()
+        raise NotImplementedError
 
 
 class LayerDataSource():
@@ -131,7 +240,7 @@ class LayerDataSource():
             Returns:
                 dataframe
         """
-        raise NotImplemented()
+        raise NotImplementedError
 
     def set_data(self, df, data_fetch_time=None):
         """ set the data for this data source
@@ -145,11 +254,33 @@ class LayerDataSource():
 
 
 class LayerController:
-    def __init__(self, minimum_datasource_cooldown_period=5):
+    # longest time in seconds the data fetch thread sleeps when no data source is scheduled to fire
+    MAX_IDLE_WAIT = 60
+
+    # shortest time in seconds the data fetch thread sleeps between passes, unless a data fetch completes
+    MIN_WAIT = 0.1
+
+    # maximum number of tooltips to remember before the cache is emptied
+    TOOLTIP_CACHE_SIZE = 512
+
+    def __init__(self, minimum_datasource_cooldown_period=5, use_processes=False):
+        """ init for LayerController
+
+            Args:
+                minimum_datasource_cooldown_period - minimum number of seconds between data fetches of a data source
+                use_processes - run data fetches in worker processes instead of threads.  Only needed for CPU bound
+                                data fetches, data fetches in processes must be picklable and return their dataframes
+                                through a pipe
+        """
         self._layer_datasources = {}
         self._layer_datarenderers = {}
+        self._options = None
+        self._tooltip_cache = {}
+        self.data_changed = threading.Event()
         self.shutdown = False
+        self._wakeup = threading.Event()
         self.minimum_datasource_cooldown_period = minimum_datasource_cooldown_period
+        self.use_processes = use_processes
 
     @classmethod
     def _mp_wrapper(cls, func, args, kwargs, q):
@@ -160,47 +291,79 @@ class LayerController:
         t = threading.Thread(target=self._thread_worker, args=())
         t.start()
 
-    def _status_message_for_datasource(self, ds):
-        html = f'<h4>{ds.name}</h4>'
+    def stop(self):
+        """ stop the data fetch thread, waking it if it is sleeping """
+        self.shutdown = True
+        self._wakeup.set()
+
+    def _status_message_for_datasource(self, ds, now=None):
+        parts = [f'<h4>{ds.name}</h4>']
         if ds.data_last_fetch_time:
-            delta = (datetime.datetime.now() - ds.data_last_fetch_time).seconds
+            if now is None:
+                now = datetime.datetime.now()
+            delta = (now - ds.data_last_fetch_time).seconds
             if delta < 180:
-                html += f'{delta} seconds ago'
+                parts.append(f'{delta} seconds ago')
             else:
-                html += f'{(delta / 60):3.1f} minutes ago'
+                parts.append(f'{(delta / 60):3.1f} minutes ago')
 
-        return html
+        return ''.join(parts)
+
+    def _get_options(self):
+        """ returns the options of all the renderers.  Renderers are fixed once the controller is started and
+            their options do not change, so the options are only collected once
+        """
+        if self._options is None:
+            self._options = [opt for dr in self._layer_datarenderers.values() for opt in dr.get_options()]
+        return self._options
 
     def build_options_html(self, jsc):
-        html = ''
+        parts = []
         opts = {}
-        for dr in self._layer_datarenderers.values():
-            for opt in dr.get_options():
-                if opt['type'] == 'Boolean':
-                    checked = ''
-                    if opt['default_value']:
-                        checked = 'checked'
-                    html += f"""<input type="checkbox" id="opt_{opt['id']}" name="opt_{opt['id']}" value="{opt['id']}" onclick="call_py('options_changed');" {checked}>{opt['text']}<br>"""
-                    opts[opt['id']] = opt['default_value']
+        for opt in self._get_options():
+            if opt['type'] == 'Boolean':
+                checked = ''
+                if opt['default_value']:
+                    checked = 'checked'
+                parts.append(f"""<input type="checkbox" id="opt_{opt['id']}" name="opt_{opt['id']}" value="{opt['id']}" onclick="call_py('options_changed');" {checked}>{opt['text']}<br>""")
+                opts[opt['id']] = opt['default_value']
         jsc.tag['options'] = opts
-        return html
+        return ''.join(parts)
 
     def get_datasource_status_messages(self):
-        keys = list(self._layer_datasources.keys())
-        status_html = ''
-        for k in keys:
-            status_html += self._status_message_for_datasource(self._layer_datasources[k])
-        return status_html
+        # every message is relative to the same moment
+        now = datetime.datetime.now()
+        return ''.join(self._status_message_for_datasource(ds, now) for ds in self._layer_datasources.values())
 
     def get_tooltip(self, layer_names, tooltip_idx):
-        html = ''
+        # nothing under the mouse
+        if not layer_names:
+            return ''
+
+        # tooltips only change when the data of one of their renderers changes, so reuse the html until then
+        names = sorted(n for n in layer_names if n in self._layer_datarenderers)
+        key = (tuple(names), tooltip_idx, tuple(self._layer_datarenderers[n].data_version for n in names))
+        html = self._tooltip_cache.get(key, None)
+        if html is None:
+            html = self._build_tooltip(names, tooltip_idx)
+            if len(self._tooltip_cache) >= self.TOOLTIP_CACHE_SIZE:
+                self._tooltip_cache.clear()
+            self._tooltip_cache[key] = html
+        return html
+
+    def _build_tooltip(self, layer_names, tooltip_idx):
+        parts = []
         for name in layer_names:
             if name in self._layer_datarenderers:
                 try:
-                    html += self._layer_datarenderers[name].get_tooltip(tooltip_idx)
+                    parts.append(self._layer_datarenderers[name].get_tooltip(tooltip_idx))
                 except Exception as e:
-                    html += repr(e) + '<br>'
-        return html
+                    parts.append(repr(e) + '<br>')
+        return ''.join(parts)
+
+    def get_render_key(self, options):
+        """ returns the combined render key of all renderers and the options """
+        return (tuple(dr.get_render_key(options) for dr in self._layer_datarenderers.values()), tuple(sorted(options.items())))
 
     def render(self, parentObj, options):
         # notify renderers that data source has been updated
@@ -211,40 +374,47 @@ class LayerController:
                 logging.error(traceback.format_exc())
 
     def update_options(self, jsc):
-        # read back all of the options
-        opts = {}
-        for dr in self._layer_datarenderers.values():
-            for opt in dr.get_options():
-                if opt['type'] == 'Boolean':
-                    optval = jsc.eval_js_code(f"""$('#opt_{opt['id']}').is(":checked")""")
-                    opts[opt['id']] = optval
-        jsc.tag['options'] = opts
+        # read back all of the options in a single round trip
+        ids = [opt['id'] for opt in self._get_options() if opt['type'] == 'Boolean']
+        optvals = []
+        if ids:
+            optvals = jsc.eval_js_code('[' + ', '.join(f"""$('#opt_{i}').is(":checked")""" for i in ids) + ']')
+        jsc.tag['options'] = dict(zip(ids, optvals))
 
     def _thread_worker(self):
         """ thread worker, coordinate data fetches """
 
-        # setup the process pool executor
+        # renderers subscribed to each data source, renderers are fixed once the controller is started
+        subscribers = {}
+        for dr in self._layer_datarenderers.values():
+            for dn in dr.subscribed_datasources:
+                subscribers.setdefault(dn, []).append(dr.name)
+
+        # setup the executor, a data source never has more than one data fetch running so one worker each is enough
         futures = {}
-        with concurrent.futures.ProcessPoolExecutor(len(self._layer_datasources)) as executor:
+        executor_class = concurrent.futures.ProcessPoolExecutor if self.use_processes else concurrent.futures.ThreadPoolExecutor
+        with executor_class(max(1, len(self._layer_datasources))) as executor:
             while not self.shutdown:
-                # loop through all the available data sources
-                keys = list(self._layer_datasources.keys())
-                for k in keys:
-                    # mark the current time
-                    current_time = datetime.datetime.now()
+                # wake ups after this point are handled by this pass or the next one
+                self._wakeup.clear()
+
+                # mark the current time once for all the data sources
+                current_time = datetime.datetime.now()
 
+                # loop through all the available data sources
+                for ds in self._layer_datasources.values():
                     # check if this jobs can fire based on time
-                    ds = self._layer_datasources[k]
                     if (ds.next_fire_time is not None) and (current_time >= ds.next_fire_time):
                         # clear the next fire time so we do not accidently refire while running
                         ds.next_fire_time = None
                         ds.fire_start_time = current_time
                         fut = executor.submit(ds.__class__.data_fetch)
+                        fut.add_done_callback(lambda _: self._wakeup.set())
                         futures[ds.name] = fut
 
-                # check processes for completion
+                # check processes for completion, completed futures are removed so iterate over a snapshot
                 dirty_renderers = set()
-                for k in list(futures.keys()):
+                for k in (list(futures) if futures else ()):
                     # continue if the future is not ready
                     if not futures[k].done():
                         continue
@@ -252,20 +422,32 @@ class LayerController:
                     # future is ready so process
                     ds = self._layer_datasources[k]
                     try:
-                        ds.set_data(futures[k].result())
+                        df = futures[k].result()
+                        changed = not ds.data.equals(df)
+                        # keep publishing the same dataframe object when the data did not change, renderers
+                        # recognize unchanged data sources by identity
+                        ds.set_data(df if changed else ds.data, current_time)
                     except:
                         logging.error(traceback.format_exc())
+                        # a failed fetch leaves the data as it was
+                        changed = False
                     del futures[k]
                     logging.info(f"""{ds.name} data ready""")
-                    ds.next_fire_time = ds.data_last_fetch_time + datetime.timedelta(seconds=max(ds.cooldown_period, self.minimum_datasource_cooldown_period))
+
+                    # the cooldown starts when the data fetch returns, even if it failed, so a failing data source is
+                    # not refired immediately
+                    cooldown = max(ds.cooldown_period, self.minimum_datasource_cooldown_period)
+                    ds.next_fire_time = datetime.datetime.now() + datetime.timedelta(seconds=cooldown)
+
+                    # nothing to do if the fetch returned the same data as last time
+                    if not changed:
+                        continue
 
                     # notify renderers that the data has changed
-                    for dr in self._layer_datarenderers.values():
-                        if ds.name in dr.subscribed_datasources:
-                            dirty_renderers.add(dr.name)
+                    dirty_renderers.update(subscribers.get(ds.name, ()))
 
                 # update dirty renderers
-                for name in list(dirty_renderers):
+                for name in dirty_renderers:
                     dr = self._layer_datarenderers[name]
                     data_dict = {}
                     for dn in dr.subscribed_datasources:
@@ -275,13 +457,30 @@ class LayerController:
                     except:
                         logging.error(traceback.format_exc())
 
-                # one second frequency
-                time.sleep(1)
+                # wake up anyone waiting to render the new data
+                if dirty_renderers:
+                    self.data_changed.set()
+
+                # sleep until the next data source is due to fire or a data fetch completes
+                timeout = self.MAX_IDLE_WAIT
+                current_time = datetime.datetime.now()
+                for ds in self._layer_datasources.values():
+                    if ds.next_fire_time is not None:
+                        timeout = min(timeout, (ds.next_fire_time - current_time).total_seconds())
+                self._wakeup.wait(max(self.MIN_WAIT, timeout))
 
 
 class LayerApp:
+    # maximum number of clients refreshed concurrently
+    CLIENT_WORKERS = 16
+
+    # longest time in seconds the refresh thread backs off after repeated errors
+    MAX_ERROR_BACKOFF = 60
+
     def __init__(self, data_sources, renderers):
         self.layer_controller = LayerController(minimum_datasource_cooldown_period=3)
+        self._client_executor = concurrent.futures.ThreadPoolExecutor(self.CLIENT_WORKERS)
+        self._shutdown_event = threading.Event()
 
         for lds in data_sources:
             self.layer_controller._layer_datasources[lds.name] = lds
@@ -344,24 +543,72 @@ class LayerApp:
     def on_options_changed(self, jsc):
         self.layer_controller.update_options(jsc)
 
-    def on_ready(self, jsc, background_image_path, drawing_context_name, display_context_name):
-        # create the render objects list
+    def on_ready(self, jsc, background_image_path, drawing_context_name, display_context_name, image_loaded_func_name=None):
+        """ load the background image and set up the canvas for a client
+
+            By default this waits here for the browser to load the image.  If image_loaded_func_name is given, the
+            browser instead calls that python handler once the image has loaded and setup finishes then.  The handler
+            must be defined by the application and call on_image_loaded with its arguments, i.e.
+
+                def image_loaded(jsc, img_width, img_height, canvas_width, canvas_height):
+                    return LAYER_APP.on_image_loaded(jsc, img_width, img_height, canvas_width, canvas_height)
+
+            Args:
+                jsc - javascript client
+                background_image_path - url to the background image
+                drawing_context_name - name of the working canvas context
+                display_context_name - name of the display canvas context
+                image_loaded_func_name - optional name of the python handler the browser calls when the image has loaded,
+                                         None to wait for the image in this call
+        """
+        jsc.tag['image_load_context'] = (drawing_context_name, display_context_name)
         f = jsc.drawing()
+
+        if image_loaded_func_name is not None:
+            # create the background image, the browser calls back when it has loaded instead of python polling for it
+            f.create_image('img_floor_plan', background_image_path,
+                           onload_code=f"image_notify_when_loaded(img_floor_plan, {drawing_context_name}, '{image_loaded_func_name}');")
+            f.render(jsc)
+
+            # render an empty frame so a rerender before the image loads does not recreate the image
+            f.render(jsc)
+            return
+
+        # create the background image
         f.create_image('img_floor_plan', background_image_path)
         f.render(jsc)
 
-        # get the canvas width and canvas height
-        canvas_width = jsc.eval_js_code(f'{drawing_context_name}.canvas.width')
-        canvas_height = jsc.eval_js_code(f'{drawing_context_name}.canvas.height')
+        # render an empty frame so a rerender does not recreate the image
+        f.render(jsc)
 
-        # wait for image to load
-        img_width, img_height = canvas_width, canvas_height
+        # wait for image to load, reading the image and canvas sizes in one round trip per check
+        sizes = None
         start_time = time.time()
         while (time.time() - start_time) < 5:
-            if jsc.eval_js_code('img_floor_plan.complete'):
-                img_width = jsc.eval_js_code('img_floor_plan.naturalWidth')
-                img_height = jsc.eval_js_code('img_floor_plan.naturalHeight')
+            sizes = jsc.eval_js_code(f'[img_floor_plan.complete, img_floor_plan.naturalWidth, img_floor_plan.naturalHeight, '
+                                     f'{drawing_context_name}.canvas.width, {drawing_context_name}.canvas.height]')
+            if sizes[0]:
                 break
+            time.sleep(0.05)
+        complete, img_width, img_height, canvas_width, canvas_height = sizes
+
+        # if the image did not load, the canvas size is used as the image size
+        if not complete or img_width <= 0:
+            img_width, img_height = canvas_width, canvas_height
+
+        self.on_image_loaded(jsc, img_width, img_height, canvas_width, canvas_height)
+
+    def on_image_loaded(self, jsc, img_width, img_height, canvas_width, canvas_height):
+        """ finish setting up the canvas for a client once its background image has loaded
+
+            Args:
+                jsc - javascript client
+                img_width - natural width of the background image
+                img_height - natural height of the background image
+                canvas_width - width of the working canvas
+                canvas_height - height of the working canvas
+        """
+        drawing_context_name, display_context_name = jsc.tag['image_load_context']
 
         # attempt to scale the image up to a normalized coordinate system of 2000 x 2000
         img_width, img_height = LayerApp.compute_image_scale(img_width, img_height)
@@ -370,8 +617,8 @@ class LayerApp:
         zoom = LayerApp.compute_zoom(canvas_width, canvas_height, img_width, img_height)
 
         # set the initial zoom to fit the image
-        jsc.eval_js_code(f"""force_zoom({drawing_context_name}.canvas.id, {display_context_name}.canvas.id, 0, 0, {zoom});""")
-        jsc.eval_js_code(f"""force_translate({drawing_context_name}.canvas.id, {display_context_name}.canvas.id, {(canvas_width / zoom - img_width) / 2}, {(canvas_height / zoom - img_height) / 2});""")
+        jsc.eval_js_code(f"""force_zoom({drawing_context_name}.canvas.id, {display_context_name}.canvas.id, 0, 0, {zoom});""" +
+                         f"""force_translate({drawing_context_name}.canvas.id, {display_context_name}.canvas.id, {(canvas_width / zoom - img_width) / 2}, {(canvas_height / zoom - img_height) / 2});""")
 
         # create the background
         root_obj = RectObject(flightplan=None, x=0, y=0, width=canvas_width, height=canvas_height, strokeStyle='rgba(0, 0, 0, 0)', fillStyle='rgba(0, 0, 0, 0)', clickable=False)
@@ -379,7 +626,6 @@ class LayerApp:
         # create the background
         image_obj = ImageObject(name='img', flightplan=None, x=0, y=0, width=img_width, height=img_height, image_name='img_floor_plan', filter_str='opacity(0.2)')
         root_obj.add_child(image_obj)
-        jsc.tag['ROOT_RENDER_OBJECT'] = root_obj
 
         # initialize the layer renderers for this jsc
         for dr in self.layer_controller._layer_datarenderers.values():
@@ -389,94 +635,189 @@ class LayerApp:
         jsc['#options'].html = self.layer_controller.build_options_html(jsc)
         self.layer_controller.update_options(jsc)
 
-        # render
-        f.render(jsc)
+        # a scene which can not move only depends on its layout and the render key, so its frames can be shared.  This
+        # relies on layer_init building the same scene for every client, see LayerRenderer.layer_init
+        jsc.tag['frame_layout'] = (canvas_width, canvas_height, img_width, img_height) if root_obj.is_static_tree() else None
+
+        # publish the scene only once it is complete, the render and tooltip threads iterate it without copying
+        jsc.tag['ROOT_RENDER_OBJECT'] = root_obj
+
+        # force the render thread to draw the new scene, it sends the first frame
+        jsc.tag.pop('frame_hash', None)
+        jsc.tag.pop('render_key', None)
+
+    def shutdown(self):
+        """ stop the refresh thread and the data fetch thread """
+        self._shutdown_event.set()
+        self.layer_controller.stop()
+        self._client_executor.shutdown(wait=False)
 
     def start(self):
         # start the thread
         t = threading.Thread(target=self.thread_worker, daemon=True)
         t.start()
 
+    def _refresh_client(self, jsc, t, do_render, do_tooltip, do_property, status_html, frame_cache):
+        """ run the refreshes which are due for a single client """
+        if do_render:
+            self._render_client(jsc, t, frame_cache)
+        if do_tooltip:
+            self._update_tooltip(jsc)
+        if do_property:
+            self._refresh_property_window(jsc)
+        if status_html is not None:
+            jsc['#datasources'].html = status_html
+
+    def _refresh_property_window(self, jsc):
+        """ refresh the property window of a client with the latest data """
+        if 'property_window' in jsc.tag:
+            layer_names = jsc.tag['property_window']['layer_names']
+            idx = jsc.tag['property_window']['idx']
+            html = self.layer_controller.get_tooltip(layer_names, idx)
+            jsc['#properties'].html = html
+
+    def _render_client(self, jsc, t, frame_cache):
+        """ render the data objects of a client if its last frame is out of date
+
+            Args:
+                jsc - javascript client
+                t - time of this tick
+                frame_cache - dictionary shared by all clients for this tick, holding the compiled javascript of every
+                              frame rendered so far keyed by render key and scene layout
+        """
+        if 'ROOT_RENDER_OBJECT' not in jsc.tag:
+            return
+
+        # skip clients whose last frame is still current.  Scenes which are not static move with time, so they are
+        # always rendered
+        options = jsc.tag.get('options', {})
+        render_key = self.layer_controller.get_render_key(options)
+        frame_layout = jsc.tag.get('frame_layout', None)
+        if frame_layout is not None and jsc.tag.get('render_key', None) == render_key:
+            return
+
+        # refresh the render objects associated with the data
+        image_obj = jsc.tag['ROOT_RENDER_OBJECT'].children['img']
+        self.layer_controller.render(image_obj, options)
+
+        # the renderers write object props directly, and hit testing is indexed by object size, so rebuild the index
+        # once new data has been rendered
+        data_versions = tuple(dr.data_version for dr in self.layer_controller._layer_datarenderers.values())
+        if jsc.tag.get('hit_index_data_versions', None) != data_versions:
+            jsc.tag['ROOT_RENDER_OBJECT'].invalidate_hit_index()
+            jsc.tag['hit_index_data_versions'] = data_versions
+
+        # clients with the same render key and scene layout draw the same frame, so only compile it once per tick
+        frame_key = (render_key, frame_layout)
+        js = frame_cache.get(frame_key, None) if frame_layout is not None else None
+        if js is None:
+            f = JSDraw('ctx_drawing', 'ctx_display')
+            f.fillStyle = 'white'
+            f.clear()
+            jsc.tag['ROOT_RENDER_OBJECT'].render(f, t)
+            js = f.compile()
+            if frame_layout is not None:
+                frame_cache[frame_key] = js
+
+        # a new render key can still produce the frame the client already shows, e.g. when a hidden layer changes
+        frame_hash = hash(js)
+        if jsc.tag.get('frame_hash', None) != frame_hash:
+            jsc.eval_js_code(js, blocking=True)
+            jsc.tag['frame_hash'] = frame_hash
+
+        # only remember the render key once the frame is on the client, so a failed render is retried next tick
+        jsc.tag['render_key'] = render_key
+
+    def _update_tooltip(self, jsc):
+        """ show the tooltip of a client if the mouse has rested over a data object, otherwise hide it """
+        if 'ROOT_RENDER_OBJECT' not in jsc.tag:
+            return
+
+        # check if we need to move the tool tip
+        mlp = jsc.eval_js_code(f"""mouse_get_last_position();""")
+        if mlp is None:
+            return
+
+        if mlp['elapsed_ms'] > 500:
+            t = time.time()
+            rolist = jsc.tag['ROOT_RENDER_OBJECT'].point_in_obj(mlp['wx'], mlp['wy'], t)
+
+            # assemble a layer list
+            tooltip_idx = None
+            layer_names = set()
+            for ro in rolist:
+                if 'layer_name' in ro.props:
+                    layer_names.add(ro.props['layer_name'])
+                    if 'idx' in ro.props:
+                        tooltip_idx = ro.props['idx']
+
+            html = self.layer_controller.get_tooltip(layer_names, tooltip_idx)
+            tooltip_state = (html, mlp['px'], mlp['py']) if html != '' else None
+        else:
+            tooltip_state = None
+
+        # only update the tooltip contents, position, and cursor if they changed, in a single round trip
+        if jsc.tag.get('tooltip_state', 'unknown') == tooltip_state:
+            return
+        if tooltip_state is not None:
+            jsc.eval_js_code(f"""tooltip_show('tooltip', {json.dumps(html)}, {mlp['px']}, {mlp['py']});""")
+        else:
+            jsc.eval_js_code("""tooltip_hide('tooltip');""")
+        jsc.tag['tooltip_state'] = tooltip_state
+
     def thread_worker(self):
         # init
         last_render_refresh_time = 0
         last_status_refresh_time = 0
         last_tooltip_check_time = 0
         last_property_refresh_time = 0
+        error_backoff = 1
 
-        # loop forever
-        while True:
+        # loop until shutdown
+        while not self._shutdown_event.is_set():
             t = time.time()
 
             try:
-                # refresh the data visually if needed
-                if (t - last_render_refresh_time) > 0.1:
-                    for jsc in get_broadcast_jsclients('/'):
-
-                        # refresh the render objects associated with the data
-                        if 'ROOT_RENDER_OBJECT' in jsc.tag:
-                            image_obj = jsc.tag['ROOT_RENDER_OBJECT'].children['img']
-                            self.layer_controller.render(image_obj, jsc.tag.get('options', {}))
-
-                            f = JSDraw('ctx_drawing', 'ctx_display')
-                            f.fillStyle = 'white'
-                            f.clear()
-                            jsc.tag['ROOT_RENDER_OBJECT'].render(f, t)
-                            f.render(jsc)
-                    last_render_refresh_time = time.time()
-
-
-                if (t - last_tooltip_check_time) > 0.1:
-                    for jsc in get_broadcast_jsclients('/'):
-                        if 'ROOT_RENDER_OBJECT' in jsc.tag:
-                            # check if we need to move the tool tip
-                            mlp = jsc.eval_js_code(f"""mouse_get_last_position();""")
-                            if mlp is not None:
-                                if mlp['elapsed_ms'] > 500:
-                                    t = time.time()
-                                    rolist = jsc.tag['ROOT_RENDER_OBJECT'].point_in_obj(mlp['wx'], mlp['wy'], t)
-
-                                    # assemble a layer list
-                                    tooltip_idx = None
-                                    layer_names = set()
-                                    for ro in rolist:
-                                        if 'layer_name' in ro.props:
-                                            layer_names.add(ro.props['layer_name'])
-                                            if 'idx' in ro.props:
-                                                tooltip_idx = ro.props['idx']
-
-                                    html = self.layer_controller.get_tooltip(layer_names, tooltip_idx)
-                                    if html != '':
-                                        jsc['#tooltip'].html = html
-                                        jsc['#tooltip'].css.left = mlp['px']
-                                        jsc['#tooltip'].css.top = mlp['py']
-                                        jsc['#tooltip'].css.visibility = 'visible'
-                                        jsc['body'].css.cursor = 'crosshair'
-                                    else:
-                                        jsc['#tooltip'].css.visibility = 'hidden'
-                                        jsc['body'].css.cursor = 'default'
-                                else:
-                                    jsc['#tooltip'].css.visibility = 'hidden'
-                                    jsc['body'].css.cursor = 'default'
-                    last_tooltip_check_time = time.time()
-
-                # refresh property window if needed
-                if (t - last_property_refresh_time) > 1:
-                    for jsc in get_broadcast_jsclients('/'):
-                        if 'property_window' in jsc.tag:
-                            layer_names = jsc.tag['property_window']['layer_names']
-                            idx = jsc.tag['property_window']['idx']
-                            html = self.layer_controller.get_tooltip(layer_names, idx)
-                            jsc['#properties'].html = html
-
-                # refresh the status if needed
-                if (t - last_status_refresh_time) > 1:
-                    for jsc in get_broadcast_jsclients('/'):
-                        jsc['#datasources'].html = self.layer_controller.get_datasource_status_messages()
-                    last_status_refresh_time = time.time()
-
-                # sleep 10ms
-                time.sleep(0.01)
+                # decide which refreshes are due this tick
+                do_render = (t - last_render_refresh_time) > 0.1
+                do_tooltip = (t - last_tooltip_check_time) > 0.1
+                do_property = (t - last_property_refresh_time) > 1
+                do_status = (t - last_status_refresh_time) > 1
+
+                if do_render or do_tooltip or do_property or do_status:
+                    # the status is the same for every client
+                    status_html = self.layer_controller.get_datasource_status_messages() if do_status else None
+
+                    # visit every client once per tick, refreshing clients concurrently so one slow connection does not
+                    # delay the rest
+                    frame_cache = {}
+                    futures = [self._client_executor.submit(self._refresh_client, jsc, t, do_render, do_tooltip, do_property, status_html, frame_cache)
+                               for jsc in get_broadcast_jsclients('/')]
+                    for fut in futures:
+                        fut.result()
+
+                    # update the refresh times
+                    t_done = time.time()
+                    if do_render:
+                        last_render_refresh_time = t_done
+                    if do_tooltip:
+                        last_tooltip_check_time = t_done
+                    if do_property:
+                        last_property_refresh_time = t_done
+                    if do_status:
+                        last_status_refresh_time = t_done
+
+                # sleep until the next refresh is due, new data forces an early render
+                next_due = min(last_render_refresh_time + 0.1, last_tooltip_check_time + 0.1, last_property_refresh_time + 1, last_status_refresh_time + 1)
+                if self.layer_controller.data_changed.wait(max(0.0, next_due - time.time())):
+                    self.layer_controller.data_changed.clear()
+                    last_render_refresh_time = 0
+
+                # a clean tick resets the error backoff
+                error_backoff = 1
             except Exception as e:
                 print(e)
-                time.sleep(60)
+                # back off on repeated errors, waking early on shutdown
+                if self._shutdown_event.wait(error_backoff):
+                    return
+                error_backoff = min(error_backoff * 2, self.MAX_ERROR_BACKOFF)
@@ -209,4 +209,47 @@ function mouse_get_last_position() {
     var elapsed_ms = d.getTime() - LAST_MOUSE_TIME;
     
     return {'wx': LAST_MOUSE_WX, 'wy': LAST_MOUSE_WY, 'px': LAST_MOUSE_PX, 'py': LAST_MOUSE_PY, 'elapsed_ms': elapsed_ms};    
-}
\ No newline at end of file
+}
+
+// --------------------------------------------------
+//  Image Query
+// --------------------------------------------------
+function image_notify_when_loaded(img, ctx, py_func_name) {
+    // call back into python with the image and canvas sizes once the image has loaded
+    // if the image fails to load, the canvas size is reported as the image size
+    let notify_loaded = function() {
+        call_py(py_func_name, img.naturalWidth, img.naturalHeight, ctx.canvas.width, ctx.canvas.height);
+    };
+    let notify_error = function() {
+        call_py(py_func_name, ctx.canvas.width, ctx.canvas.height, ctx.canvas.width, ctx.canvas.height);
+    };
+
+    if (img.complete) {
+        if (img.naturalWidth > 0) {
+            notify_loaded();
+        } else {
+            notify_error();
+        }
+    } else {
+        img.onload = notify_loaded;
+        img.onerror = notify_error;
+    }
+}
+
+
+// --------------------------------------------------
+//  Tooltip Functions
+// --------------------------------------------------
+function tooltip_show(tooltip_id, html, px, py) {
+    let tooltip = document.getElementById(tooltip_id);
+    tooltip.innerHTML = html;
+    tooltip.style.left = px + 'px';
+    tooltip.style.top = py + 'px';
+    tooltip.style.visibility = 'visible';
+    document.body.style.cursor = 'crosshair';
+}
+
+function tooltip_hide(tooltip_id) {
+    document.getElementById(tooltip_id).style.visibility = 'hidden';
+    document.body.style.cursor = 'default';
+}